@@ -1,11 +1,19 @@
 # main.py
 import json
+import multiprocessing
 import os
+import selectors
 import subprocess
 import time
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
 
-from monitor import monitor_processes
+import numpy as np
+
+from monitor import monitor_processes, window_metrics
+from dataset import dataset_paths, make_dataset
+from gpu import gpu_available, train_models_gpu
+from protocol import close_result_slot, decode_result, open_result_slot, read_result_slot
 
 
 CONFIGS = [
@@ -15,123 +23,389 @@ CONFIGS = [
     {"seed": 4, "lr": 0.01,  "epochs": 6000, "n_samples": 5000, "n_features": 30},
 ]
 
+DATA_DIR = "data"
+
 
-def _run_worker(cfg):
+def _prepare_datasets(configs):
+    """
+    Generate each config's dataset once in the parent and save it as .npy.
+    Workers np.load(..., mmap_mode="r") it instead of regenerating, and
+    the parallel and sequential runs read the same page-cache pages.
+    Returns copies of configs with x_path / y_path set.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    prepared = []
+    for cfg in configs:
+        X, y = make_dataset(cfg)
+        x_path, y_path = dataset_paths(cfg, DATA_DIR)
+        np.save(x_path, X)
+        np.save(y_path, y)
+        prepared.append({**cfg, "x_path": x_path, "y_path": y_path})
+    return prepared
+
+
+class _SpawnedWorker:
+    """
+    Minimal Popen-like handle for a child started with os.posix_spawnp.
+    Exposes pid, stdout/stderr, returncode, wait() and communicate() so
+    callers don't care which launcher was used.
+    """
+
+    def __init__(self, pid, out_fd, err_fd):
+        self.pid = pid
+        self.returncode = None
+        self.stdout = os.fdopen(out_fd, "rb", buffering=0)
+        self.stderr = os.fdopen(err_fd, "rb", buffering=0)
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def communicate(self):
+        return _communicate_all([self])[0]
+
+
+def _communicate_all(procs):
+    """
+    Drain stdout/stderr of every worker and reap them in one event loop:
+    all pipes plus a pidfd per worker (where available) sit in a single
+    selector, so one wait covers every worker instead of blocking in
+    communicate() on each in turn. Works for _SpawnedWorker and Popen.
+    Returns [(out, err)] in procs order.
+    """
+    bufs = [([], []) for _ in procs]
+    with selectors.DefaultSelector() as sel:
+        for i, p in enumerate(procs):
+            sel.register(p.stdout, selectors.EVENT_READ, (i, 0))
+            sel.register(p.stderr, selectors.EVENT_READ, (i, 1))
+            if hasattr(os, "pidfd_open"):
+                try:
+                    sel.register(os.pidfd_open(p.pid), selectors.EVENT_READ, (i, None))
+                except OSError:
+                    pass  # already reaped, wait() below is a no-op
+
+        while sel.get_map():
+            for key, _ in sel.select():
+                i, stream = key.data
+                if stream is None:
+                    # pidfd readable: the worker exited, reap it now
+                    sel.unregister(key.fileobj)
+                    os.close(key.fileobj)
+                    procs[i].wait()
+                    continue
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    bufs[i][stream].append(chunk)
+                else:
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+
+    for p in procs:
+        p.wait()
+    return [(b"".join(out), b"".join(err)) for out, err in bufs]
+
+
+def _numba_threads(concurrent):
+    """Numba threads per worker so concurrent workers don't oversubscribe."""
+    return max(1, (os.cpu_count() or 1) // concurrent)
+
+
+def _run_worker(cfg, numba_threads=None, result_slot=None):
     """
     Launch worker.py as separate OS process.
-    Returns (proc, cfg)
+    Prefers posix_spawn (no page-table copy of the parent), falls back
+    to subprocess.Popen if posix_spawn is unavailable or fails.
+    numba_threads caps the worker's Numba and OpenMP (Cython kernel)
+    threads via NUMBA_NUM_THREADS / OMP_NUM_THREADS.
+    result_slot is a path from open_result_slot() for the worker's result.
+    Returns proc handle (pid, returncode, communicate() -> bytes).
     """
+    if result_slot is not None:
+        cfg = {**cfg, "result_slot": result_slot}
     cfg_json = json.dumps(cfg)
+    argv = ["python3", "worker.py", cfg_json]
+    env = os.environ
+    if numba_threads is not None:
+        env = {**env, "NUMBA_NUM_THREADS": str(numba_threads),
+               "OMP_NUM_THREADS": str(numba_threads)}
+
+    if hasattr(os, "posix_spawnp"):
+        r_out, w_out = os.pipe()
+        r_err, w_err = os.pipe()
+        try:
+            pid = os.posix_spawnp(
+                argv[0], argv, env,
+                file_actions=[
+                    (os.POSIX_SPAWN_DUP2, w_out, 1),
+                    (os.POSIX_SPAWN_DUP2, w_err, 2),
+                    (os.POSIX_SPAWN_CLOSE, r_out),
+                    (os.POSIX_SPAWN_CLOSE, r_err),
+                    (os.POSIX_SPAWN_CLOSE, w_out),
+                    (os.POSIX_SPAWN_CLOSE, w_err),
+                ],
+            )
+        except OSError:
+            for fd in (r_out, w_out, r_err, w_err):
+                os.close(fd)
+        else:
+            # Parent keeps only the read ends
+            os.close(w_out)
+            os.close(w_err)
+            return _SpawnedWorker(pid, r_out, r_err)
+
     p = subprocess.Popen(
-        ["python3", "worker.py", cfg_json],
+        argv,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True
+        env=env,
     )
     return p
 
 
-def run_parallel(sample_interval=0.2):
+def _collect_result(p, cfg, out, err, slot_buf):
+    """
+    Turn a finished worker into a result dict: the shared-memory slot if
+    the worker wrote it, else its MessagePack stdout, else an error entry.
+    """
+    if p.returncode != 0:
+        return {
+            "pid": p.pid,
+            "seed": cfg["seed"],
+            "error": err.decode(errors="replace").strip() or "worker failed"
+        }
+
+    if slot_buf is not None:
+        r = read_result_slot(slot_buf, cfg)
+        if r is not None:
+            return r
+
+    try:
+        return decode_result(out)
+    except Exception:
+        return {
+            "pid": p.pid,
+            "seed": cfg["seed"],
+            "error": "Invalid result from worker",
+            "raw_out_tail": out[-300:].decode(errors="replace"),
+            "raw_err_tail": err[-300:].decode(errors="replace"),
+        }
+
+
+def run_parallel(configs=CONFIGS, sample_interval=0.2):
     procs = []
     pid_list = []
 
     start_total = time.time()
 
-    # Spawn all
-    for cfg in CONFIGS:
-        p = _run_worker(cfg)
-        procs.append((cfg, p))
-        pid_list.append(p.pid)
-        print(f"[PAR] Started PID={p.pid} cfg={cfg}")
+    # Spawn all; split the CPUs between them so the comparison with the
+    # sequential run (one worker with every CPU) stays fair
+    threads = _numba_threads(len(configs))
+    slots = []
+    try:
+        for cfg in configs:
+            slot_path, slot_buf = open_result_slot()
+            slots.append((slot_path, slot_buf))
+            p = _run_worker(cfg, numba_threads=threads, result_slot=slot_path)
+            procs.append((cfg, p, slot_buf))
+            pid_list.append(p.pid)
+            print(f"[PAR] Started PID={p.pid} cfg={cfg}")
+
+        # Start monitor in parallel thread
+        mon_result = {}
+
+        def mon_task():
+            nonlocal mon_result
+            mon_result = monitor_processes(pid_list, sample_interval=sample_interval)
+
+        t = Thread(target=mon_task, daemon=True)
+        t.start()
+
+        # Collect worker outputs
+        results = []
+        outputs = _communicate_all([p for _, p, _ in procs])
+        for (cfg, p, slot_buf), (out, err) in zip(procs, outputs):
+            results.append(_collect_result(p, cfg, out, err, slot_buf))
+    finally:
+        # Unlink the /dev/shm files even on errors or Ctrl-C
+        for slot_path, slot_buf in slots:
+            close_result_slot(slot_path, slot_buf)
+
+    # Ensure monitor thread finished
+    t.join(timeout=10)
+
+    end_total = time.time()
+
+    # Attach monitoring metrics to each result
+    for r in results:
+        pid = r.get("pid")
+        if pid in mon_result:
+            r["os_metrics"] = mon_result[pid]
+        else:
+            r["os_metrics"] = None
+
+    results.sort(key=lambda x: x.get("seed", 0))
+    total_time = round(end_total - start_total, 6)
+    return results, total_time
+
+
+def run_sequential(configs=CONFIGS, sample_interval=0.2):
+    results = []
+    total_start = time.time()
+
+    for cfg in configs:
+        start_one = time.time()
+        slot_path, slot_buf = open_result_slot()
+        try:
+            p = _run_worker(cfg, result_slot=slot_path)
+            pid = p.pid
+
+            # Monitor single PID while it runs
+            mon = {}
+            def mon_task():
+                nonlocal mon
+                mon = monitor_processes([pid], sample_interval=sample_interval)
+
+            t = Thread(target=mon_task, daemon=True)
+            t.start()
+
+            out, err = p.communicate()
+            t.join(timeout=10)
+
+            end_one = time.time()
+
+            r = _collect_result(p, cfg, out, err, slot_buf)
+        finally:
+            close_result_slot(slot_path, slot_buf)
+        if "error" in r:
+            results.append(r)
+            continue
+
+        r["wall_time_one_sec"] = round(end_one - start_one, 6)
+        r["os_metrics"] = mon.get(pid)
+        results.append(r)
+
+    total_end = time.time()
+    results.sort(key=lambda x: x.get("seed", 0))
+    total_time = round(total_end - total_start, 6)
+    return results, total_time
+
+
+def make_pool(processes):
+    """
+    Pool of long-lived workers for the "pool" backend.
+    forkserver forks each worker from a clean server process that has
+    already imported worker.py (NumPy etc.), so imports are paid once and
+    the parent's heap is never copied.
+    Workers are found through the pool's private _pool list; monitoring
+    them needs their PIDs and Pool has no public accessor.
+    Each worker's Numba threads are capped so the pool never runs more
+    kernel threads than there are CPUs.
+    """
+    # Imported here so only the pool backend pulls worker.py (and Numba)
+    # into the parent
+    from worker import limit_threads
+
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["worker"])
+    return ctx.Pool(processes, initializer=limit_threads,
+                    initargs=(_numba_threads(processes),))
+
+
+def _task_error(cfg, e):
+    return {
+        "pid": None,
+        "seed": cfg["seed"],
+        "error": f"{type(e).__name__}: {e}",
+    }
+
+
+def run_parallel_pool(pool, configs=CONFIGS, sample_interval=0.2):
+    from worker import pool_task
 
-    # Start monitor in parallel thread
+    pid_list = [p.pid for p in pool._pool]
+    stop = Event()
+
+    start_total = time.time()
+
+    # Start monitor on the pool's worker PIDs, they outlive the tasks
     mon_result = {}
 
     def mon_task():
         nonlocal mon_result
-        mon_result = monitor_processes(pid_list, sample_interval=sample_interval)
+        mon_result = monitor_processes(pid_list, sample_interval=sample_interval,
+                                       stop_event=stop, keep_samples=True)
 
     t = Thread(target=mon_task, daemon=True)
     t.start()
 
+    # Submit all
+    pending = []
+    for cfg in configs:
+        pending.append((cfg, pool.apply_async(pool_task, (cfg,))))
+        print(f"[PAR] Submitted to pool cfg={cfg}")
+
     # Collect worker outputs
     results = []
-    for cfg, p in procs:
-        out, err = p.communicate()
-
-        if p.returncode != 0:
-            results.append({
-                "pid": p.pid,
-                "seed": cfg["seed"],
-                "error": err.strip() or "worker failed"
-            })
-            continue
-
+    for cfg, a in pending:
         try:
-            r = json.loads(out.strip())
-        except Exception:
-            r = {
-                "pid": p.pid,
-                "seed": cfg["seed"],
-                "error": "Invalid JSON from worker",
-                "raw_out_tail": out[-300:],
-                "raw_err_tail": err[-300:],
-            }
+            results.append(a.get())
+        except Exception as e:
+            results.append(_task_error(cfg, e))
 
-        results.append(r)
+    # Stop the clock before waiting for the monitor to wind down
+    end_total = time.time()
 
-    # Ensure monitor thread finished
+    stop.set()
     t.join(timeout=10)
 
-    end_total = time.time()
-
-    # Attach monitoring metrics to each result
+    # A pool worker may run several tasks, so keep only the samples
+    # taken during each task's own window
     for r in results:
-        pid = r.get("pid")
-        if pid in mon_result:
-            r["os_metrics"] = mon_result[pid]
-        else:
+        m = mon_result.get(r.get("pid"))
+        if m is None or "timeline" not in m:
             r["os_metrics"] = None
+        else:
+            r["os_metrics"] = window_metrics(m["timeline"], r["task_start_ts"], r["task_end_ts"])
 
     results.sort(key=lambda x: x.get("seed", 0))
     total_time = round(end_total - start_total, 6)
     return results, total_time
 
 
-def run_sequential(sample_interval=0.2):
+def run_sequential_pool(pool, configs=CONFIGS, sample_interval=0.2):
+    from worker import pool_task
+
+    pid_list = [p.pid for p in pool._pool]
     results = []
     total_start = time.time()
 
-    for cfg in CONFIGS:
+    for cfg in configs:
         start_one = time.time()
-        p = _run_worker(cfg)
-        pid = p.pid
+        stop = Event()
 
-        # Monitor single PID while it runs
+        # Any pool worker may pick the task up, so watch them all
         mon = {}
         def mon_task():
             nonlocal mon
-            mon = monitor_processes([pid], sample_interval=sample_interval)
+            mon = monitor_processes(pid_list, sample_interval=sample_interval, stop_event=stop)
 
         t = Thread(target=mon_task, daemon=True)
         t.start()
 
-        out, err = p.communicate()
-        t.join(timeout=10)
-
+        try:
+            r = pool.apply(pool_task, (cfg,))
+        except Exception as e:
+            r = _task_error(cfg, e)
         end_one = time.time()
 
-        if p.returncode != 0:
-            results.append({
-                "pid": pid,
-                "seed": cfg["seed"],
-                "error": err.strip() or "worker failed"
-            })
-            continue
+        stop.set()
+        t.join(timeout=10)
 
-        r = json.loads(out.strip())
-        r["wall_time_one_sec"] = round(end_one - start_one, 6)
-        r["os_metrics"] = mon.get(pid)
+        if "error" not in r:
+            r["wall_time_one_sec"] = round(end_one - start_one, 6)
+            r["os_metrics"] = mon.get(r["pid"])
         results.append(r)
 
     total_end = time.time()
@@ -140,41 +414,149 @@ def run_sequential(sample_interval=0.2):
     return results, total_time
 
 
+def run_gpu(configs=CONFIGS, sample_interval=0.2, batched=True):
+    """
+    "gpu" backend: train in the parent with CuPy. batched=True trains
+    every config in one batched run (the parallel case), otherwise one
+    config at a time. The parent PID is the only process to monitor.
+    """
+    pid = os.getpid()
+    stop = Event()
+
+    mon_result = {}
+
+    def mon_task():
+        nonlocal mon_result
+        mon_result = monitor_processes([pid], sample_interval=sample_interval, stop_event=stop)
+
+    t = Thread(target=mon_task, daemon=True)
+    t.start()
+
+    start_total = time.time()
+    if batched:
+        results = train_models_gpu(configs)
+    else:
+        results = []
+        for cfg in configs:
+            start_one = time.time()
+            r = train_models_gpu([cfg])[0]
+            r["wall_time_one_sec"] = round(time.time() - start_one, 6)
+            results.append(r)
+    end_total = time.time()
+
+    stop.set()
+    t.join(timeout=10)
+
+    for r in results:
+        r["os_metrics"] = mon_result.get(pid)
+
+    results.sort(key=lambda x: x.get("seed", 0))
+    total_time = round(end_total - start_total, 6)
+    return results, total_time
+
+
+def run_threads(configs=CONFIGS, sample_interval=0.2, parallel=True):
+    """
+    "thread" backend: train in the parent, one thread per config when
+    parallel, relying on NumPy/Numba releasing the GIL. No spawn, pipe or
+    result protocol is involved. All work shares the parent PID, which is
+    the one process monitored; each result also records the CPU time of
+    the thread that trained it.
+    """
+    from worker import thread_task
+
+    pid = os.getpid()
+    stop = Event()
+
+    mon_result = {}
+
+    def mon_task():
+        nonlocal mon_result
+        mon_result = monitor_processes([pid], sample_interval=sample_interval, stop_event=stop)
+
+    t = Thread(target=mon_task, daemon=True)
+    t.start()
+
+    start_total = time.time()
+    if parallel:
+        with ThreadPoolExecutor(len(configs)) as ex:
+            # Same per-worker kernel thread cap as the process backend
+            kernel_threads = _numba_threads(len(configs))
+            futures = [ex.submit(thread_task, cfg, kernel_threads) for cfg in configs]
+            results = []
+            for cfg, f in zip(configs, futures):
+                try:
+                    results.append(f.result())
+                except Exception as e:
+                    results.append(_task_error(cfg, e))
+    else:
+        results = []
+        for cfg in configs:
+            start_one = time.time()
+            try:
+                r = thread_task(cfg, _numba_threads(1))
+            except Exception as e:
+                results.append(_task_error(cfg, e))
+                continue
+            r["wall_time_one_sec"] = round(time.time() - start_one, 6)
+            results.append(r)
+    end_total = time.time()
+
+    stop.set()
+    t.join(timeout=10)
+
+    for r in results:
+        r["os_metrics"] = mon_result.get(pid)
+
+    results.sort(key=lambda x: x.get("seed", 0))
+    total_time = round(end_total - start_total, 6)
+    return results, total_time
+
+
 def summarize(results):
-    # compute peaks across all workers
-    rss_peaks = []
-    cpu_avgs = []
-    cpu_peaks = []
-    train_times = []
+    # compute peaks across all workers in one pass
+    n_train = 0
+    train_sum = 0.0
+    n_metrics = 0
+    rss_peak = 0.0
+    rss_sum = 0.0
+    cpu_avg_sum = 0.0
+    cpu_peak = 0.0
 
     for r in results:
         if "train_time_sec" in r:
-            train_times.append(r["train_time_sec"])
+            n_train += 1
+            train_sum += r["train_time_sec"]
         m = r.get("os_metrics") or {}
         if m:
-            rss_peaks.append(m.get("rss_peak_mb", 0.0))
-            cpu_avgs.append(m.get("cpu_avg", 0.0))
-            cpu_peaks.append(m.get("cpu_peak", 0.0))
-
-    def safe_max(xs): return round(max(xs), 4) if xs else 0.0
-    def safe_avg(xs): return round(sum(xs) / len(xs), 4) if xs else 0.0
+            n_metrics += 1
+            rss = m.get("rss_peak_mb", 0.0)
+            rss_sum += rss
+            if rss > rss_peak:
+                rss_peak = rss
+            cpu_avg_sum += m.get("cpu_avg", 0.0)
+            cpu = m.get("cpu_peak", 0.0)
+            if cpu > cpu_peak:
+                cpu_peak = cpu
+
+    def safe_avg(total, n): return round(total / n, 4) if n else 0.0
 
     return {
         "workers": len(results),
-        "train_time_avg_sec": round(sum(train_times) / len(train_times), 6) if train_times else 0.0,
-        "rss_peak_max_mb": safe_max(rss_peaks),
-        "rss_peak_avg_mb": safe_avg(rss_peaks),
-        "cpu_avg_avg": safe_avg(cpu_avgs),
-        "cpu_peak_max": safe_max(cpu_peaks),
+        "train_time_avg_sec": round(train_sum / n_train, 6) if n_train else 0.0,
+        "rss_peak_max_mb": round(rss_peak, 4),
+        "rss_peak_avg_mb": safe_avg(rss_sum, n_metrics),
+        "cpu_avg_avg": safe_avg(cpu_avg_sum, n_metrics),
+        "cpu_peak_max": round(cpu_peak, 4),
     }
 
 
-def write_report(par_time, seq_time, par_sum, seq_sum, filename="report.txt"):
+def write_report(par_time, seq_time, par_sum, seq_sum, parent_pid, filename="report.txt"):
     speedup = round(seq_time / par_time, 4) if par_time > 0 else 0.0
 
     lines = []
     lines.append("=== ORCHESTRATION PROJECT REPORT ===")
-    lines.append(f"Host Parent PID: {os.getpid()}")
+    lines.append(f"Host Parent PID: {parent_pid}")
     lines.append("")
     lines.append("---- TIMING ----")
     lines.append(f"Parallel total wall time  : {par_time} sec")
@@ -200,23 +582,52 @@ def write_report(par_time, seq_time, par_sum, seq_sum, filename="report.txt"):
 
 def main():
     print("=== ORCHESTRATOR (subprocess + OS monitoring) ===")
-    print("Parent PID:", os.getpid())
-    print("Running on:", os.uname().sysname, os.uname().release)
+    parent_pid = os.getpid()
+    u = os.uname()
+    print("Parent PID:", parent_pid)
+    print("Running on:", u.sysname, u.release)
 
     sample_interval = 0.2  # adjust if needed
+    # "process": one spawned interpreter per config (default)
+    # "pool": one forkserver Pool reused by both runs
+    # "thread": one thread per config inside this process
+    # "gpu": all configs batched on one CUDA device (needs cupy)
+    backend = os.environ.get("ORCH_BACKEND", "process")
+    if backend == "gpu" and not gpu_available():
+        print("No CUDA device/cupy, falling back to process backend")
+        backend = "process"
+    print("Backend:", backend)
+
+    configs = _prepare_datasets(CONFIGS)
+
+    if backend == "pool":
+        pool = make_pool(len(configs))
+        try:
+            par_results, par_time = run_parallel_pool(pool, configs, sample_interval=sample_interval)
+            seq_results, seq_time = run_sequential_pool(pool, configs, sample_interval=sample_interval)
+        finally:
+            pool.close()
+            pool.join()
+    elif backend == "thread":
+        par_results, par_time = run_threads(configs, sample_interval=sample_interval)
+        seq_results, seq_time = run_threads(configs, sample_interval=sample_interval, parallel=False)
+    elif backend == "gpu":
+        par_results, par_time = run_gpu(configs, sample_interval=sample_interval)
+        seq_results, seq_time = run_gpu(configs, sample_interval=sample_interval, batched=False)
+    else:
+        par_results, par_time = run_parallel(configs, sample_interval=sample_interval)
+        seq_results, seq_time = run_sequential(configs, sample_interval=sample_interval)
 
-    par_results, par_time = run_parallel(sample_interval=sample_interval)
     with open("results_parallel.json", "w") as f:
         json.dump(par_results, f, indent=2)
 
-    seq_results, seq_time = run_sequential(sample_interval=sample_interval)
     with open("results_sequential.json", "w") as f:
         json.dump(seq_results, f, indent=2)
 
     par_sum = summarize(par_results)
     seq_sum = summarize(seq_results)
 
-    write_report(par_time, seq_time, par_sum, seq_sum, filename="report.txt")
+    write_report(par_time, seq_time, par_sum, seq_sum, parent_pid, filename="report.txt")
 
     print("\n=== DONE ===")
     print("Saved: results_parallel.json, results_sequential.json, report.txt")
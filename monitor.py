@@ -1,21 +1,88 @@
 # monitor.py
+import os
+import select
 import time
 import psutil
 
 
-def monitor_processes(pid_list, sample_interval=0.2):
+# /proc is read directly where it exists; psutil is the fallback
+_USE_PROC = os.path.isdir("/proc/self")
+if _USE_PROC:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Longest epoll wait between stop_event checks
+_STOP_POLL = 0.05
+
+
+class _Gone(Exception):
+    """The process exited, is a zombie, or can no longer be read."""
+
+
+def _read_proc(paths):
+    """
+    (cpu_seconds, rss_bytes) straight from /proc/<pid>/stat and statm:
+    two small reads and a split per sample, no psutil object layer.
     """
-    Monitors list of PIDs until they all exit.
+    stat_path, statm_path = paths
+    try:
+        with open(stat_path, "rb") as f:
+            stat = f.read()
+        with open(statm_path, "rb") as f:
+            statm = f.read()
+    except OSError:
+        raise _Gone
+    # comm (field 2) may contain spaces, so split after its closing ')';
+    # fields[0] is then state (field 3), utime/stime are fields 14/15
+    fields = stat[stat.rindex(b")") + 2:].split()
+    if fields[0] == b"Z":
+        raise _Gone
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    return cpu_seconds, int(statm.split()[1]) * _PAGE_SIZE
+
+
+def _read_psutil(p):
+    """Same values as _read_proc via psutil, for systems without /proc."""
+    try:
+        # oneshot: one underlying read serves both queries
+        with p.oneshot():
+            t = p.cpu_times()
+            rss = p.memory_info().rss
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        raise _Gone
+    return t.user + t.system, rss
+
+
+def monitor_processes(pid_list, sample_interval=0.2, stop_event=None, keep_samples=False):
+    """
+    Monitors list of PIDs until they all exit (or stop_event is set,
+    for long-lived processes such as pool workers).
+    CPU% is the change in utime+stime over the change in wall time
+    between samples, like psutil's cpu_percent().
+    With keep_samples, each pid's metrics also get a "timeline" list of
+    (ts, cpu, rss_mb) so callers can cut out a per-task window.
     Returns dict: pid -> metrics (avg cpu, peak cpu, peak rss, etc.)
     """
-    procs = {}
+    read = _read_proc if _USE_PROC else _read_psutil
+    sources = {}  # pid -> what read() takes
+    prev = {}     # pid -> (cpu_seconds, ts) of the last sample
     metrics = {}
 
-    # Create psutil processes
+    def finish(pid):
+        if metrics[pid]["alive"]:
+            metrics[pid]["alive"] = False
+            metrics[pid]["end_ts"] = time.time()
+
     for pid in pid_list:
         try:
-            p = psutil.Process(pid)
-            procs[pid] = p
+            if _USE_PROC:
+                src = (f"/proc/{pid}/stat", f"/proc/{pid}/statm")
+            else:
+                src = psutil.Process(pid)
+            # Prime the CPU counter to avoid a first-sample 0.0 artifact
+            cpu_seconds, _ = read(src)
+            sources[pid] = src
+            prev[pid] = (cpu_seconds, time.time())
             metrics[pid] = {
                 "samples": 0,
                 "cpu_sum": 0.0,
@@ -25,9 +92,9 @@ def monitor_processes(pid_list, sample_interval=0.2):
                 "end_ts": None,
                 "alive": True,
             }
-            # Prime cpu_percent to avoid first-call 0.0 artifact
-            p.cpu_percent(interval=None)
-        except Exception:
+            if keep_samples:
+                metrics[pid]["timeline"] = []
+        except (_Gone, psutil.Error):
             # If PID is gone immediately
             metrics[pid] = {
                 "samples": 0,
@@ -40,38 +107,81 @@ def monitor_processes(pid_list, sample_interval=0.2):
                 "error": "Process not accessible",
             }
 
+    # A pidfd becomes readable when its process exits, so epoll can sleep
+    # until the next sample is due and still see exits immediately
+    ep = None
+    pidfds = {}
+    if hasattr(os, "pidfd_open") and hasattr(select, "epoll"):
+        ep = select.epoll()
+        for pid in sources:
+            try:
+                fd = os.pidfd_open(pid)
+            except OSError:
+                continue  # already gone/reaped, the next read notices
+            pidfds[fd] = pid
+            ep.register(fd, select.EPOLLIN)
+
     # Loop until all finish
     while True:
         alive_any = False
 
-        for pid, p in list(procs.items()):
-            if not p.is_running():
-                # finished
-                if metrics[pid]["alive"]:
-                    metrics[pid]["alive"] = False
-                    metrics[pid]["end_ts"] = time.time()
+        for pid, src in list(sources.items()):
+            try:
+                cpu_seconds, rss = read(src)
+            except _Gone:
+                finish(pid)
+                del sources[pid]
                 continue
 
             alive_any = True
-            try:
-                cpu = p.cpu_percent(interval=None)  # since last call
-                rss_mb = p.memory_info().rss / (1024 * 1024)
-
-                m = metrics[pid]
-                m["samples"] += 1
-                m["cpu_sum"] += cpu
-                if cpu > m["cpu_peak"]:
-                    m["cpu_peak"] = cpu
-                if rss_mb > m["rss_peak_mb"]:
-                    m["rss_peak_mb"] = rss_mb
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                metrics[pid]["alive"] = False
-                metrics[pid]["end_ts"] = time.time()
+            now = time.time()
+            last_cpu, last_ts = prev[pid]
+            prev[pid] = (cpu_seconds, now)
+            cpu = (cpu_seconds - last_cpu) / (now - last_ts) * 100 if now > last_ts else 0.0
+            rss_mb = rss / (1024 * 1024)
+
+            m = metrics[pid]
+            m["samples"] += 1
+            m["cpu_sum"] += cpu
+            if cpu > m["cpu_peak"]:
+                m["cpu_peak"] = cpu
+            if rss_mb > m["rss_peak_mb"]:
+                m["rss_peak_mb"] = rss_mb
+            if keep_samples:
+                m["timeline"].append((now, cpu, rss_mb))
 
         if not alive_any:
             break
 
-        time.sleep(sample_interval)
+        if ep is not None:
+            deadline = time.time() + sample_interval
+            while sources:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                if stop_event is not None:
+                    # epoll can't wait on an Event, so wake up in short
+                    # slices to notice stop without a full interval's delay
+                    if stop_event.is_set():
+                        break
+                    timeout = min(timeout, _STOP_POLL)
+                for fd, _ in ep.poll(timeout):
+                    pid = pidfds.pop(fd)
+                    ep.unregister(fd)
+                    os.close(fd)
+                    sources.pop(pid, None)
+                    finish(pid)
+            if stop_event is not None and stop_event.is_set():
+                break
+        elif stop_event is None:
+            time.sleep(sample_interval)
+        elif stop_event.wait(sample_interval):
+            break
+
+    if ep is not None:
+        for fd in pidfds:
+            os.close(fd)
+        ep.close()
 
     # finalize avg cpu and durations
     for pid, m in metrics.items():
@@ -88,3 +198,22 @@ def monitor_processes(pid_list, sample_interval=0.2):
         del m["cpu_sum"]
 
     return metrics
+
+
+def window_metrics(timeline, start_ts, end_ts):
+    """
+    Metrics for the samples of one pid's timeline that fall in
+    [start_ts, end_ts]. Used when one process runs several tasks.
+    """
+    samples = [s for s in timeline if start_ts <= s[0] <= end_ts]
+    cpus = [cpu for _, cpu, _ in samples]
+    rss = [r for _, _, r in samples]
+    return {
+        "samples": len(samples),
+        "cpu_peak": round(max(cpus), 4) if cpus else 0.0,
+        "rss_peak_mb": round(max(rss), 4) if rss else 0.0,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "duration_sec_monitored": round(end_ts - start_ts, 6),
+        "cpu_avg": round(sum(cpus) / len(cpus), 4) if cpus else 0.0,
+    }
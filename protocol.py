@@ -0,0 +1,90 @@
+# protocol.py
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import msgpack
+
+
+# First byte of every message on stdout, bump when the layout changes
+RESULT_VERSION = 1
+
+
+def emit(obj):
+    """Write one versioned MessagePack message to stdout."""
+    sys.stdout.buffer.write(bytes([RESULT_VERSION]) + msgpack.packb(obj))
+    sys.stdout.buffer.flush()
+
+
+def decode_result(out):
+    """
+    Decode the worker's versioned MessagePack message.
+    Raises ValueError on empty output or unknown version.
+    """
+    if not out or out[0] != RESULT_VERSION:
+        raise ValueError("unexpected result version")
+    return msgpack.unpackb(out[1:])
+
+
+# Result slot: a tmpfs file the parent maps and the worker writes a fixed
+# struct into. Layout: version, seed, train_time_sec, accuracy, pid.
+# The version byte stays 0 until the worker has written the slot.
+SHM_DIR = "/dev/shm"
+RESULT_STRUCT = struct.Struct("<Biddi")
+
+
+def open_result_slot():
+    """
+    Create and map a zeroed result slot in SHM_DIR.
+    Returns (path, mmap), or (None, None) when there is no tmpfs to use,
+    in which case the worker falls back to MessagePack on stdout.
+    """
+    if not os.path.isdir(SHM_DIR):
+        return None, None
+    fd, path = tempfile.mkstemp(prefix="orch-result-", dir=SHM_DIR)
+    try:
+        os.ftruncate(fd, RESULT_STRUCT.size)
+        buf = mmap.mmap(fd, RESULT_STRUCT.size)
+    except BaseException:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    return path, buf
+
+
+def write_result_slot(path, result):
+    """Worker side: pack the result straight into the parent's slot."""
+    with open(path, "r+b") as f, mmap.mmap(f.fileno(), RESULT_STRUCT.size) as buf:
+        RESULT_STRUCT.pack_into(
+            buf, 0, RESULT_VERSION, result["seed"],
+            result["train_time_sec"], result["accuracy"], result["pid"],
+        )
+
+
+def read_result_slot(buf, cfg):
+    """
+    Parent side: rebuild the worker's result dict from the slot plus the
+    config it was given. Returns None if the worker never wrote it.
+    """
+    version, seed, train_time, acc, pid = RESULT_STRUCT.unpack_from(buf)
+    if version != RESULT_VERSION:
+        return None
+    return {
+        "pid": pid,
+        "seed": seed,
+        "lr": float(cfg["lr"]),
+        "epochs": int(cfg["epochs"]),
+        "n_samples": cfg["n_samples"],
+        "n_features": cfg["n_features"],
+        "train_time_sec": train_time,
+        "accuracy": acc,
+    }
+
+
+def close_result_slot(path, buf):
+    if buf is not None:
+        buf.close()
+        os.unlink(path)
@@ -0,0 +1,69 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args = -O3 -march=native -ffast-math -fopenmp
+# distutils: extra_link_args = -fopenmp
+# distutils: libraries = m
+# train_f30.pyx
+"""
+Logistic-regression training specialised to n_features == 30.
+With F a compile-time constant the feature loops fully unroll: the
+forward pass becomes 30 unit-stride axpys over the samples and the
+sigmoid a single loop, both of which the compiler vectorises, and the
+samples are split over OpenMP threads with prange.
+Build in place with `cythonize -i train_f30.pyx` (flags above; libm
+provides libmvec's vectorised expf) and select with ORCH_KERNEL=f30.
+"""
+from cython.parallel cimport parallel, prange
+from libc.math cimport expf
+cimport openmp
+
+cdef enum:
+    F = 30
+
+
+def set_num_threads(int n):
+    openmp.omp_set_num_threads(n)
+
+
+def train(const float[:, ::1] XT, const float[::1] y,
+          float[::1] w, float[::1] err, double lr, int epochs):
+    """
+    Run all epochs in place on w. XT is X transposed (contiguous, 30 x n),
+    err an n_samples scratch buffer.
+    """
+    cdef Py_ssize_t n = XT.shape[1]
+    cdef Py_ssize_t i, j, k
+    cdef int e = 0
+    cdef float g = 0, wj = 0
+    cdef float scale = lr / n
+    cdef float w_local[F]
+
+    if XT.shape[0] != F or w.shape[0] != F:
+        raise ValueError("train_f30 needs exactly 30 features")
+
+    for j in range(F):
+        w_local[j] = w[j]
+
+    # One OpenMP team for the whole run: every thread walks the epochs and
+    # the pranges below share the work (with a barrier after each one),
+    # instead of forking a new team for every loop of every epoch
+    with nogil, parallel():
+        for e in range(epochs):
+            # Forward: z = X @ w as 30 unit-stride axpys over the samples
+            for i in prange(n, schedule="static"):
+                err[i] = 0.0
+            for j in range(F):
+                wj = w_local[j]
+                for i in prange(n, schedule="static"):
+                    err[i] += wj * XT[j, i]
+            # Sigmoid and error in one vectorisable pass
+            for i in prange(n, schedule="static"):
+                err[i] = 1.0 / (1.0 + expf(-err[i])) - y[i]
+            # Backward: one dot product per feature
+            for k in prange(F, schedule="static"):
+                g = 0.0
+                for i in range(n):
+                    g = g + XT[k, i] * err[i]
+                w_local[k] = w_local[k] - scale * g
+
+    for j in range(F):
+        w[j] = w_local[j]
@@ -2,32 +2,141 @@
 import json
 import os
 import sys
+import threading
 import time
+
 import numpy as np
 
+from dataset import make_dataset
+from protocol import emit, write_result_slot
 
-def train_model(config):
-    # Seed for reproducibility per process
-    np.random.seed(config["seed"])
+# Epoch kernel: "numpy" (default), "numba" or "f30". The compiled
+# kernels are opt-in and only imported when chosen: on the shipped
+# 5000x30 configs both are slower than the NumPy/BLAS loop, and Numba's
+# import costs every worker ~0.2 s and ~60 MB RSS.
+KERNEL = os.environ.get("ORCH_KERNEL", "numpy")
+
+train_f30 = None
+if KERNEL == "f30":
+    try:
+        import train_f30  # prebuilt with `cythonize -i train_f30.pyx`
+    except ImportError:  # not built, fall back to plain NumPy
+        pass
+
+njit = None
+if KERNEL == "numba":
+    try:
+        from numba import get_num_threads, njit, prange, set_num_threads
+    except ImportError:  # numba missing, fall back to plain NumPy
+        pass
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _step(X, y, w, lr, partial):
+        """
+        One fused gradient-descent epoch: X is streamed once, sigmoid and
+        gradient are computed per row, per-chunk partial grads reduced at end.
+        partial is a (n_chunks, n_features) float64 scratch buffer; passing
+        it in (rather than sizing it from get_num_threads() here) keeps the
+        kernel free of dynamic globals so cache=True works.
+        """
+        n, f = X.shape
+        n_chunks = partial.shape[0]
+        chunk = (n + n_chunks - 1) // n_chunks
+
+        for c in prange(n_chunks):
+            for j in range(f):
+                partial[c, j] = 0.0
+            for i in range(c * chunk, min((c + 1) * chunk, n)):
+                z = 0.0
+                for j in range(f):
+                    z += X[i, j] * w[j]
+                err = 1.0 / (1.0 + np.exp(-z)) - y[i]
+                for j in range(f):
+                    partial[c, j] += err * X[i, j]
+
+        for j in range(f):
+            g = 0.0
+            for c in range(n_chunks):
+                g += partial[c, j]
+            w[j] -= lr * g / n
+
+    # Same epoch for callers on non-main threads (the "thread" backend):
+    # serial and nogil, since Numba's default workqueue layer can't run
+    # parallel kernels from several threads at once. Not cached, the
+    # cache would collide with the parallel build of the same function.
+    _step_serial = njit(nogil=True, fastmath=True)(_step.py_func)
+else:
+    _step = _step_serial = None
+
+
+def limit_threads(n):
+    """Cap the Numba and Cython kernels' thread counts (no-op without them)."""
+    if _step is not None:
+        set_num_threads(max(1, min(n, get_num_threads())))
+    if train_f30 is not None:
+        # OpenMP's thread count is per calling thread
+        train_f30.set_num_threads(max(1, n))
 
-    # Synthetic dataset
-    X = np.random.randn(config["n_samples"], config["n_features"])
-    true_w = np.random.randn(config["n_features"])
-    y_prob = 1 / (1 + np.exp(-(X @ true_w)))
-    y = (y_prob > 0.5).astype(int)
+
+def train_model(config):
+    # Dataset saved by the parent is mapped read-only, so every process
+    # reading the same file shares one copy in the page cache
+    if "x_path" in config:
+        X = np.load(config["x_path"], mmap_mode="r")
+        y = np.load(config["y_path"], mmap_mode="r")
+    else:
+        X, y = make_dataset(config)
+    # No-op for datasets written by make_dataset, casts anything else
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
 
     # Model params
-    w = np.zeros(config["n_features"])
+    w = np.zeros(config["n_features"], dtype=np.float32)
     lr = float(config["lr"])
     epochs = int(config["epochs"])
 
+    # The Cython kernel is specialised to exactly 30 features
+    use_f30 = train_f30 is not None and X.shape[1] == 30
+    step = None if use_f30 else _step
+    if step is not None and threading.current_thread() is not threading.main_thread():
+        step = _step_serial
+    if step is not None:
+        partial = np.empty((get_num_threads() if step is _step else 1, X.shape[1]))
+        # JIT compile (or load from cache) outside the timed region
+        step(X[:1], y[:1], w.copy(), 0.0, partial)
+
     start = time.time()
 
     # Gradient descent (logistic regression)
-    for _ in range(epochs):
-        preds = 1 / (1 + np.exp(-(X @ w)))
-        grad = X.T @ (preds - y) / len(y)
-        w -= lr * grad
+    if use_f30:
+        # Every epoch runs in C; XT/err as on the NumPy path
+        XT = np.ascontiguousarray(X.T)
+        err = np.empty(len(y), dtype=np.float32)
+        train_f30.train(XT, y, w, err, lr, epochs)
+    elif step is not None:
+        for _ in range(epochs):
+            step(X, y, w, lr, partial)
+    else:
+        # Contiguous transpose so the gradient pass is unit-stride too
+        XT = np.ascontiguousarray(X.T)
+        n = len(y)
+        # Buffers reused every epoch instead of fresh temporaries
+        preds = np.empty(n, dtype=X.dtype)
+        err = np.empty_like(preds)
+        grad = np.empty_like(w)
+        for _ in range(epochs):
+            np.dot(X, w, out=preds)
+            # In-place 1/(1+exp(-z))
+            np.negative(preds, out=preds)
+            np.exp(preds, out=preds)
+            preds += 1
+            np.reciprocal(preds, out=preds)
+            np.subtract(preds, y, out=err)
+            np.dot(XT, err, out=grad)
+            grad *= lr / n
+            w -= grad
 
     end = time.time()
 
@@ -47,15 +156,41 @@ def train_model(config):
     }
 
 
+def pool_task(config):
+    """
+    Pool entry point: train_model plus the task's wall-clock window, so
+    the parent can attribute monitor samples when a pool worker runs
+    more than one task.
+    """
+    start_ts = time.time()
+    r = train_model(config)
+    r["task_start_ts"] = start_ts
+    r["task_end_ts"] = time.time()
+    return r
+
+
+def thread_task(config, threads):
+    """
+    Thread-backend entry point: caps this thread's kernel threads (the
+    Numba and OpenMP settings are per calling thread), then trains and
+    records the CPU time this thread spent on the task.
+    """
+    limit_threads(threads)
+    cpu_start = time.thread_time()
+    r = train_model(config)
+    r["thread_cpu_sec"] = round(time.thread_time() - cpu_start, 6)
+    return r
+
+
 def main():
     if len(sys.argv) < 2:
-        print(json.dumps({"error": "Missing config JSON in argv"}))
+        emit({"error": "Missing config JSON in argv"})
         sys.exit(1)
 
     try:
         config = json.loads(sys.argv[1])
     except Exception as e:
-        print(json.dumps({"error": f"Bad JSON config: {e}"}))
+        emit({"error": f"Bad JSON config: {e}"})
         sys.exit(2)
 
     # Optional: allow “workload factor” to make CPU usage more visible in VM
@@ -65,7 +200,12 @@ def main():
     for _ in range(repeats):
         best = train_model(config)
 
-    print(json.dumps(best))  # One JSON line only
+    # The parent's shared-memory slot when it gave us one, otherwise one
+    # MessagePack message on stdout (standalone runs, no tmpfs)
+    if "result_slot" in config:
+        write_result_slot(config["result_slot"], best)
+    else:
+        emit(best)
 
 
 if __name__ == "__main__":